@@ -4,30 +4,48 @@ Telegram User Monitor - Forward messages from public groups without joining them
 This script uses a regular Telegram user account to monitor messages and forward them.
 """
 
+import io
 import os
 import json
+import atexit
 import logging
+import queue
 import asyncio
-import signal
+from logging.handlers import QueueHandler, QueueListener
 import sys
-import time
-import fcntl
-import yaml  # Add YAML import
 import shutil
-from datetime import datetime, timedelta
-from telethon import TelegramClient, events
-from telethon.tl.types import Channel, User, Chat, ChatEmpty, PeerChannel, PeerChat, PeerUser
-from telethon.errors import ChatAdminRequiredError, ChannelPrivateError, UsernameNotOccupiedError
+from dataclasses import dataclass
+from telethon import TelegramClient, events, utils
+from telethon.tl.types import MessageMediaWebPage
+from telethon.errors import FloodWaitError
 from dotenv import load_dotenv
 
+# cryptg provides a C implementation of Telegram's AES-IGE; Telethon picks
+# it up automatically when importable, so the import is best-effort only
+try:
+    import cryptg  # noqa: F401
+except ImportError:
+    cryptg = None
+
+# orjson is a much faster drop-in JSON codec; fall back to the stdlib
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Load environment variables
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Configure logging. Handlers only enqueue records; a background listener
+# thread does the formatting and stderr write, so a slow or contended
+# stream never stalls the event loop mid-send
+_log_queue = queue.Queue(-1)
+logging.basicConfig(level=logging.INFO, handlers=[QueueHandler(_log_queue)])
+_log_stream = logging.StreamHandler()
+_log_stream.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+_log_listener = QueueListener(_log_queue, _log_stream)
+_log_listener.start()
+atexit.register(_log_listener.stop)
 logger = logging.getLogger(__name__)
 
 # Proxy configuration for Telethon (SOCKS5 at 127.0.0.1:1111)
@@ -53,6 +71,12 @@ sources:
     id: -1001222222222  # Channel ID
     target_topic: 3  # Messages from this channel will go to topic 3
 
+  # Example of a channel forwarded server-side (fastest, but no "From:"
+  # header and no topic routing)
+  - type: channel
+    id: -1001444444444
+    native_forward: true
+
   # Private group sources (messages will be filtered based on sender)
   - type: private_group
     id: -1001333333333  # Private group ID
@@ -81,21 +105,66 @@ sources:
             f.write(example_config)
         logger.info("Created example configuration file: config.yaml.example")
     except Exception as e:
-        logger.error(f"Error creating example config file: {e}")
+        logger.error("Error creating example config file: %s", e)
+
+# Sidecar file caching the parsed YAML config as JSON, keyed by mtime
+CONFIG_CACHE_FILE = 'config.yaml.cache.json'
+
+def read_json_file(path):
+    """Read a JSON file, using orjson when available"""
+    if orjson is not None:
+        with open(path, 'rb') as f:
+            return orjson.loads(f.read())
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def write_json_file(path, data):
+    """Write a JSON file, using orjson when available"""
+    if orjson is not None:
+        with open(path, 'wb') as f:
+            f.write(orjson.dumps(data))
+    else:
+        with open(path, 'w') as f:
+            json.dump(data, f)
+
+def load_yaml_config(path):
+    """Parse the YAML config, reusing the JSON sidecar cache when it is fresh"""
+    try:
+        if (os.path.exists(CONFIG_CACHE_FILE)
+                and os.path.getmtime(CONFIG_CACHE_FILE) >= os.path.getmtime(path)):
+            return read_json_file(CONFIG_CACHE_FILE)
+    except Exception as e:
+        logger.warning("Could not use config cache, parsing YAML: %s", e)
+
+    # yaml is only needed on a cache miss at boot, so import it here and
+    # let the module be reclaimed instead of sitting in steady-state RSS.
+    # Prefer the libyaml C loader when PyYAML was built with it; same
+    # safe-load semantics, much faster parse
+    import yaml
+    with open(path, 'r') as f:
+        config = yaml.load(f, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+
+    # Rewrite the cache atomically so a crash cannot leave a truncated file
+    try:
+        tmp_path = CONFIG_CACHE_FILE + '.tmp'
+        write_json_file(tmp_path, config)
+        os.replace(tmp_path, CONFIG_CACHE_FILE)
+    except Exception as e:
+        logger.warning("Could not write config cache: %s", e)
+
+    return config
 
 # Load configuration
 def load_config():
     try:
         # Try to load YAML config first
         if os.path.exists('config.yaml'):
-            with open('config.yaml', 'r') as f:
-                config = yaml.safe_load(f)
-                logger.info("Loaded configuration from config.yaml")
+            config = load_yaml_config('config.yaml')
+            logger.info("Loaded configuration from config.yaml")
         # Fall back to JSON if YAML doesn't exist
         elif os.path.exists('config.json'):
-            with open('config.json', 'r') as f:
-                config = json.load(f)
-                logger.info("Loaded configuration from config.json")
+            config = read_json_file('config.json')
+            logger.info("Loaded configuration from config.json")
         else:
             logger.error("No configuration file found. Please create either config.yaml or config.json")
             
@@ -114,18 +183,33 @@ def load_config():
         
         # Check if global topic_id is provided
         if 'topic_id' in config:
-            logger.info(f"Global topic ID configured: {config['topic_id']}")
+            logger.info("Global topic ID configured: %s", config['topic_id'])
         
         # Check for per-source target_topic
         if 'sources' in config:
             for i, source in enumerate(config['sources']):
                 if 'target_topic' in source:
                     source_name = source.get('id', source.get('username', f'source {i+1}'))
-                    logger.info(f"Source-specific topic ID configured for {source_name}: {source['target_topic']}")
-        
+                    logger.info("Source-specific topic ID configured for %s: %s", source_name, source['target_topic'])
+
+        # Normalize sender filters to frozensets once so the message handlers
+        # do O(1) membership checks without per-message list coercion
+        for source in config.get('sources', []):
+            if 'user_ids' in source and source['user_ids']:
+                user_ids = source['user_ids']
+                source['user_ids'] = frozenset(user_ids if isinstance(user_ids, list) else [user_ids])
+            if 'sender_info' in source:
+                sender_info = source['sender_info']
+                if 'username' in sender_info:
+                    usernames = sender_info['username']
+                    sender_info['username'] = frozenset([usernames] if isinstance(usernames, str) else usernames)
+                if 'user_id' in sender_info:
+                    user_ids = sender_info['user_id']
+                    sender_info['user_id'] = frozenset(user_ids if isinstance(user_ids, list) else [user_ids])
+
         return config
     except Exception as e:
-        logger.error(f"Error loading config: {e}")
+        logger.error("Error loading config: %s", e)
         return None
 
 # Initialize Telegram client
@@ -136,27 +220,99 @@ if not api_id or not api_hash:
     logger.error("API ID or API Hash not found in environment variables")
     exit(1)
 
+# Convert once so Telethon doesn't re-parse the string on every connection
+try:
+    api_id = int(api_id)
+except ValueError:
+    logger.error("TELEGRAM_API_ID must be an integer")
+    exit(1)
+
 client = TelegramClient('user_session', api_id, api_hash, proxy=PROXY)
 
-# Store known entities to avoid repeated resolution
-known_entities = {}
+# Target channel resolved to its InputPeer at startup so every send hands
+# Telethon the wire-format peer directly, skipping the per-call ID ->
+# entity -> input-peer conversion
+target_entity = None
+
+@dataclass(frozen=True, slots=True)
+class SourceRule:
+    """Immutable per-source dispatch state, flattened out of the config dict
+
+    Built once at startup so the hot path reads slotted attributes instead
+    of walking nested dict lookups per message.
+    """
+    kind: str
+    topic_id: int | None
+    allow_user_ids: frozenset
+    allow_usernames: frozenset
+    filtered: bool
+    footer_prefix: str | None
+    native_forward: bool
+
+def _build_rule(source):
+    sender_info = source.get('sender_info') or {}
+    return SourceRule(
+        kind=source['type'],
+        topic_id=source.get('target_topic'),
+        allow_user_ids=(frozenset(sender_info.get('user_id', ()))
+                        | frozenset(source.get('user_ids') or ())),
+        allow_usernames=frozenset(sender_info.get('username', ())),
+        filtered='sender_info' in source or bool(source.get('user_ids')),
+        footer_prefix=source.get('_footer_prefix'),
+        native_forward=bool(source.get('native_forward')),
+    )
+
+# Lookup tables mapping chat ID / username to a SourceRule, built once at
+# startup so the message handlers do O(1) lookups instead of scanning
+# config['sources']
+sources_by_channel_id = {}
+sources_by_private_group_id = {}
+sources_by_username = {}
+
+def build_source_maps(config):
+    """Build the per-source SourceRule tables keyed by chat ID / username
+
+    Must run before any handler is registered: a message arriving between
+    registration and the map build would otherwise be dropped for lack of
+    a matching source.
+    """
+    sources_by_channel_id.clear()
+    sources_by_private_group_id.clear()
+    sources_by_username.clear()
+    # The decision memo keys on rule identity; drop it with the old rules
+    # so a recycled id() can never serve another source's cached decision
+    _forward_decisions.clear()
+    for source in config.get('sources', []):
+        if source.get('type') == 'channel' and 'id' in source:
+            # Normalize the ID to its canonical -100 integer form so the
+            # key matches event.chat_id, and write it back so handler
+            # registration uses the same ID
+            channel_id = source['id']
+            if not str(channel_id).startswith('-100'):
+                channel_id = int(f"-100{abs(channel_id)}")
+                source['id'] = channel_id
+            sources_by_channel_id[channel_id] = _build_rule(source)
+        elif source.get('type') == 'private_group' and 'id' in source:
+            sources_by_private_group_id[source['id']] = _build_rule(source)
+        elif source.get('type') == 'public_group' and 'username' in source:
+            sources_by_username[source['username']] = _build_rule(source)
 
 async def resolve_entities(config):
     """Pre-resolve all entities in the configuration"""
-    global known_entities
-    
+    global target_entity
+
     # Resolve target channel
     try:
         target_channel = await client.get_entity(config['target_channel_id'])
-        known_entities[config['target_channel_id']] = target_channel
-        logger.info(f"Successfully resolved target channel: {target_channel.title}")
+        target_entity = utils.get_input_peer(target_channel)
+        logger.info("Successfully resolved target channel: %s", target_channel.title)
         
         # Inform if using global topic in a supergroup
         if 'topic_id' in config:
-            logger.info(f"Configured to send messages to global topic {config['topic_id']} in group {target_channel.title}")
+            logger.info("Configured to send messages to global topic %s in group %s", config['topic_id'], target_channel.title)
             # Check if the target is actually a supergroup (required for topics)
             if not hasattr(target_channel, 'megagroup') or not target_channel.megagroup:
-                logger.warning(f"Warning: Target {target_channel.title} may not be a supergroup. Topics may not work.")
+                logger.warning("Warning: Target %s may not be a supergroup. Topics may not work.", target_channel.title)
         
         # Check if using per-source topics
         topic_sources = []
@@ -167,92 +323,121 @@ async def resolve_entities(config):
                     topic_sources.append(f"{source_name} → topic {source['target_topic']}")
             
             if topic_sources:
-                logger.info(f"Configured to use per-source topics: {', '.join(topic_sources)}")
+                logger.info("Configured to use per-source topics: %s", ', '.join(topic_sources))
                 # Check if the target is actually a supergroup (required for topics)
                 if not hasattr(target_channel, 'megagroup') or not target_channel.megagroup:
-                    logger.warning(f"Warning: Target {target_channel.title} may not be a supergroup. Topics may not work.")
+                    logger.warning("Warning: Target %s may not be a supergroup. Topics may not work.", target_channel.title)
     except Exception as e:
-        logger.error(f"Error resolving target channel: {e}")
-        logger.error(f"Could not resolve target channel ID from config: {config['target_channel_id']}")
+        logger.error("Error resolving target channel: %s", e)
+        logger.error("Could not resolve target channel ID from config: %s", config['target_channel_id'])
         logger.error("Please check your config.yaml file and ensure the target_channel_id is correct")
         exit(1)
     
-    # Resolve source entities
+    # Resolve source entities concurrently — each resolution is a network
+    # round-trip, so gathering turns N sequential RTTs into roughly one
     if 'sources' in config:
+        resolvable = []
         for source in config['sources']:
-            try:
-                if source.get('type') == 'channel' and 'id' in source:
-                    try:
-                        entity = await client.get_entity(source['id'])
-                        known_entities[source['id']] = entity
-                        logger.info(f"Resolved channel: {entity.title}")
-                    except Exception as e:
-                        logger.warning(f"Could not resolve channel {source['id']}: {e}")
-                elif source.get('type') == 'public_group' and 'username' in source:
-                    try:
-                        entity = await client.get_entity(source['username'])
-                        known_entities[source['username']] = entity
-                        logger.info(f"Resolved public group: {entity.title}")
-                    except Exception as e:
-                        logger.warning(f"Could not resolve public group @{source['username']}: {e}")
-                elif source.get('type') == 'private_group' and 'id' in source:
-                    # Store the ID for later use in message handler
-                    known_entities[source['id']] = {'id': source['id'], 'type': 'private_group'}
-                    logger.info(f"Stored private group ID: {source['id']}")
-            except Exception as e:
-                source_id = source.get('id', source.get('username', 'unknown'))
-                logger.warning(f"Error processing source {source_id}: {e}")
+            if source.get('type') == 'channel' and 'id' in source:
+                resolvable.append((source, source['id']))
+            elif source.get('type') == 'public_group' and 'username' in source:
+                resolvable.append((source, source['username']))
+            # Private groups are addressed by ID directly; no resolution needed
+
+        results = await asyncio.gather(
+            *(client.get_entity(key) for _, key in resolvable),
+            return_exceptions=True
+        )
+        for (source, key), entity in zip(resolvable, results):
+            if isinstance(entity, Exception):
+                logger.warning("Could not resolve source %s: %s", key, entity)
                 logger.warning("This source will be skipped")
+            else:
+                # The source title never changes, so build the static part of
+                # the message footer once instead of per forwarded message
+                source['_footer_prefix'] = f"--------------------------------\nFrom: {entity.title} - "
+                logger.info("Resolved source: %s", entity.title)
+
+        # Pre-resolve allow-listed user IDs (also concurrently) so sender
+        # lookups during message handling hit the cache instead of the network
+        allow_listed_ids = sorted({
+            user_id
+            for source in config['sources'] if 'sender_info' in source
+            for user_id in source['sender_info'].get('user_id', ())
+        })
+        if allow_listed_ids:
+            user_results = await asyncio.gather(
+                *(client.get_entity(user_id) for user_id in allow_listed_ids),
+                return_exceptions=True
+            )
+            for user_id, result in zip(allow_listed_ids, user_results):
+                if isinstance(result, Exception):
+                    logger.warning("Could not resolve user %s: %s", user_id, result)
+
+async def collect_from_users(sources):
+    """Union the sender allow-lists of a group of sources for Telethon's from_users= filter
+
+    Returns a list of user IDs, or None when any source is unfiltered or an
+    allow-listed username cannot be resolved — in which case the handler must
+    accept all senders and filter in Python as before.
+    """
+    from_users = set()
+    for source in sources:
+        sender_info = source.get('sender_info')
+        if sender_info and ('username' in sender_info or 'user_id' in sender_info):
+            from_users.update(sender_info.get('user_id', ()))
+            for username in sender_info.get('username', ()):
+                try:
+                    entity = await client.get_entity(username)
+                    from_users.add(entity.id)
+                except Exception as e:
+                    logger.warning("Could not resolve allow-listed user @%s: %s", username, e)
+                    return None
+        elif source.get('user_ids'):
+            from_users.update(source['user_ids'])
+        else:
+            # This source forwards every sender, so the handler cannot be
+            # restricted at the library level
+            return None
+    return list(from_users)
 
 # Register event handlers for each source type
 async def register_event_handlers():
     """Register event handlers for each source type"""
-    # Get all channel IDs from config
+    # Get all channel IDs from config (already normalized to their -100
+    # form by build_source_maps)
     channel_ids = []
     for source in config['sources']:
         if source['type'] == 'channel' and 'id' in source:
-            # Ensure channel ID is in the correct format
-            channel_id = source['id']
-            # If the ID doesn't start with -100, add it
-            if not str(channel_id).startswith('-100'):
-                channel_id = int(f"-100{abs(channel_id)}")
-                source['id'] = channel_id  # Update the config with the correct ID
-            channel_ids.append(channel_id)
-            logger.info(f"Added channel ID: {channel_id}")
+            channel_ids.append(source['id'])
+            logger.info("Added channel ID: %s", source['id'])
     
     # Register a specific handler for channels if we have any
     if channel_ids:
-        logger.info(f"Registering event handler for channels: {channel_ids}")
+        logger.info("Registering event handler for channels: %s", channel_ids)
         
         @client.on(events.NewMessage(chats=channel_ids))
         async def channel_handler(event):
             """Handle messages from channels"""
             try:
-                # Get the chat where the message was sent
-                chat = await event.get_chat()
-                logger.info(f"Received message from channel: {chat.id} - {chat.title}")
-                
+                # Route on event.chat_id, which is available without awaiting
+                # a full entity fetch
+                chat_id = event.chat_id
+                logger.info("Received message from channel: %s", chat_id)
+
                 # Find the matching source config
-                source_config = None
-                for source in config['sources']:
-                    if source['type'] == 'channel':
-                        # Normalize both IDs to the same format for comparison
-                        config_id = str(source['id']).replace('-100', '')
-                        event_id = str(chat.id).replace('-100', '')
-                        if config_id == event_id:
-                            source_config = source
-                            break
-                
+                source_config = sources_by_channel_id.get(chat_id)
+
                 if not source_config:
-                    logger.warning(f"No matching source config found for channel {chat.id}")
+                    logger.warning("No matching source config found for channel %s", chat_id)
                     return
-                
+
                 # Forward all channel messages
-                logger.info(f"Forwarding message from channel {chat.title}")
-                await forward_message(event)
+                logger.info("Forwarding message from channel %s", chat_id)
+                schedule_forward(event)
             
             except Exception as e:
-                logger.error(f"Error processing channel message: {e}")
+                logger.error("Error processing channel message: %s", e)
     
     # Get all private group IDs from config
     private_group_ids = []
@@ -262,311 +447,465 @@ async def register_event_handlers():
     
     # Register a specific handler for private groups if we have any
     if private_group_ids:
-        logger.info(f"Registering event handler for private groups: {private_group_ids}")
-        
-        @client.on(events.NewMessage(chats=private_group_ids))
+        logger.info("Registering event handler for private groups: %s", private_group_ids)
+
+        # When every private group filters by sender, hand the union of the
+        # allow-lists to Telethon so filtered-out messages never reach Python.
+        # The per-source checks below still enforce the per-group lists.
+        private_from_users = await collect_from_users(
+            [s for s in config['sources'] if s['type'] == 'private_group' and 'id' in s])
+
+        @client.on(events.NewMessage(chats=private_group_ids, from_users=private_from_users))
         async def private_group_handler(event):
             """Handle messages from private groups"""
             try:
-                # Get the chat where the message was sent
-                chat = await event.get_chat()
-                logger.info(f"Received message from private group: {chat.id} - {chat.title}")
-                
+                # Route on event.chat_id, which matches the marked ID used in
+                # the config and needs no entity fetch
+                chat_id = event.chat_id
+                logger.info("Received message from private group: %s", chat_id)
+
                 # Find the matching source config
-                source_config = None
-                for source in config['sources']:
-                    if source['type'] == 'private_group' and chat.id == source['id']:
-                        source_config = source
-                        break
-                
+                source_config = sources_by_private_group_id.get(chat_id)
+
                 if not source_config:
-                    logger.warning(f"No matching source config found for private group {chat.id}")
+                    logger.warning("No matching source config found for private group %s", chat_id)
                     return
-                
-                # Get the sender of the message
-                sender = await event.get_sender()
-                logger.info(f"Message sender: {sender.id} - {sender.first_name}")
-                
-                # Check if we should forward based on sender_info
-                should_forward = False
-                
-                # If sender_info is configured, check if the sender is in the allowed list
-                if 'sender_info' in source_config:
-                    sender_info = source_config['sender_info']
-                    
-                    # Check username list if configured
-                    if 'username' in sender_info:
-                        usernames = sender_info['username']
-                        if isinstance(usernames, str):
-                            usernames = [usernames]
-                        
-                        if hasattr(sender, 'username') and sender.username in usernames:
-                            should_forward = True
-                    
-                    # Check user_id list if configured
-                    if 'user_id' in sender_info:
-                        user_ids = sender_info['user_id']
-                        if not isinstance(user_ids, list):
-                            user_ids = [user_ids]
-                        
-                        if sender.id in user_ids:
-                            should_forward = True
-                
-                # If no sender_info or sender not in allowed list, check user_ids
-                elif 'user_ids' in source_config and source_config['user_ids']:
-                    if sender.id in source_config['user_ids']:
-                        should_forward = True
-                else:
-                    # If no filtering is configured, forward all messages
-                    should_forward = True
-                
+
+                # Filter on event.sender_id first; the full sender entity is
+                # only fetched when a username check needs it or when the
+                # message is actually forwarded
+                sender_id = event.sender_id
+                sender = None
+                logger.info("Message sender: %s", sender_id)
+
+                # Check the memoized decision on the id first; only fetch the
+                # full sender entity when a username allow-list needs it
+                should_forward = should_forward_sender(source_config, sender_id, None)
+                if not should_forward and source_filters_by_username(source_config):
+                    sender = event.sender or await event.get_sender()
+                    should_forward = should_forward_sender(
+                        source_config, sender_id, getattr(sender, 'username', None))
+
                 if should_forward:
-                    logger.info(f"Forwarding message from {sender.first_name} in private group {chat.id}")
-                    await forward_message(event)
+                    if sender is None:
+                        sender = event.sender or await event.get_sender()
+                    logger.info("Forwarding message from %s in private group %s", sender.first_name, chat_id)
+                    schedule_forward(event, sender=sender)
                 else:
-                    logger.debug(f"Ignoring message from non-monitored user {sender.first_name} in private group {chat.id}")
+                    logger.debug("Ignoring message from non-monitored user %s in private group %s", sender_id, chat_id)
             
             except Exception as e:
-                logger.error(f"Error processing private group message: {e}")
+                logger.error("Error processing private group message: %s", e)
     
-    # Register a general handler for all other message types
-    @client.on(events.NewMessage())
+    # Get all public group usernames from config
+    public_group_usernames = []
+    for source in config['sources']:
+        if source['type'] == 'public_group' and 'username' in source:
+            public_group_usernames.append(source['username'])
+
+    if not public_group_usernames:
+        return
+
+    # Register a handler restricted to the configured public groups so
+    # Telethon filters unrelated updates before the callback runs
+    logger.info("Registering event handler for public groups: %s", public_group_usernames)
+
+    # Same library-level sender filter as for private groups
+    public_from_users = await collect_from_users(
+        [s for s in config['sources'] if s['type'] == 'public_group' and 'username' in s])
+
+    @client.on(events.NewMessage(chats=public_group_usernames, from_users=public_from_users))
     async def general_handler(event):
-        """Handle messages from channels and public groups"""
+        """Handle messages from public groups"""
         try:
             # Get the chat where the message was sent
-            chat = await event.get_chat()
-            logger.info(f"Received message from: {chat.id} - {getattr(chat, 'title', 'Unknown')}")
-            
-            # Skip if this is a private group (handled by the specific handler)
-            if any(source['type'] == 'private_group' and chat.id == source['id'] for source in config['sources']):
-                logger.debug(f"Skipping private group message in general handler: {chat.id}")
-                return
-            
-            # Skip if this is a channel (handled by the specific handler)
-            if any(source['type'] == 'channel' and chat.id == source['id'] for source in config['sources']):
-                logger.debug(f"Skipping channel message in general handler: {chat.id}")
-                return
-            
-            # Check if this is a public group we're monitoring
-            source_config = None
-            for source in config['sources']:
-                if source['type'] == 'public_group' and hasattr(chat, 'username') and chat.username == source['username']:
-                    source_config = source
-                    break
-            
+            chat = event.chat or await event.get_chat()
+            logger.info("Received message from: %s - %s", chat.id, getattr(chat, 'title', 'Unknown'))
+
+            # Find the matching source config
+            source_config = sources_by_username.get(getattr(chat, 'username', None))
+
             if not source_config:
+                logger.warning("No matching source config found for public group %s", chat.id)
                 return
             
-            # Get the sender of the message
-            sender = await event.get_sender()
-            
-            # For channels, forward all messages
-            if source_config['type'] == 'channel':
-                logger.info(f"Forwarding message from channel {chat.title}")
-                await forward_message(event)
-                return
-            
-            # For public groups, check if we should forward based on sender_info or user_ids
-            if source_config['type'] == 'public_group':
-                should_forward = False
-                
-                # Check sender_info if configured
-                if 'sender_info' in source_config:
-                    sender_info = source_config['sender_info']
-                    
-                    # Check username list
-                    if 'username' in sender_info:
-                        usernames = sender_info['username']
-                        if isinstance(usernames, str):
-                            usernames = [usernames]
-                        
-                        if hasattr(sender, 'username') and sender.username in usernames:
-                            should_forward = True
-                    
-                    # Check user_id list
-                    if 'user_id' in sender_info:
-                        user_ids = sender_info['user_id']
-                        if not isinstance(user_ids, list):
-                            user_ids = [user_ids]
-                        
-                        if sender.id in user_ids:
-                            should_forward = True
-                
-                # If no sender_info or sender not in allowed list, check user_ids
-                elif 'user_ids' in source_config and source_config['user_ids']:
-                    if sender.id in source_config['user_ids']:
-                        should_forward = True
-                else:
-                    # If no filtering is configured, forward all messages
-                    should_forward = True
-                
-                if should_forward:
-                    logger.info(f"Forwarding message from {sender.first_name} in {chat.title}")
-                    await forward_message(event)
-                else:
-                    logger.debug(f"Ignoring message from non-monitored user {sender.first_name} in {chat.title}")
-        
+            # Filter on event.sender_id first; only fetch the full sender
+            # entity when a username check needs it or the message forwards
+            sender_id = event.sender_id
+            sender = None
+
+            # Check the memoized decision on the id first; only fetch the
+            # full sender entity when a username allow-list needs it
+            should_forward = should_forward_sender(source_config, sender_id, None)
+            if not should_forward and source_filters_by_username(source_config):
+                sender = event.sender or await event.get_sender()
+                should_forward = should_forward_sender(
+                    source_config, sender_id, getattr(sender, 'username', None))
+
+            if should_forward:
+                if sender is None:
+                    sender = event.sender or await event.get_sender()
+                logger.info("Forwarding message from %s in %s", sender.first_name, chat.title)
+                schedule_forward(event, chat=chat, sender=sender)
+            else:
+                logger.debug("Ignoring message from non-monitored user %s in %s", sender_id, chat.title)
+
         except Exception as e:
-            logger.error(f"Error processing message: {e}")
+            logger.error("Error processing message: %s", e)
+
+# Memoized forward decisions keyed by (rule identity, sender). id() is only
+# stable while the rule lives, so build_source_maps clears this whenever it
+# rebuilds the rule tables
+_forward_decisions = {}
+
+def should_forward_sender(rule, sender_id, sender_username):
+    """Decide whether a message from this sender should be forwarded
+
+    Pure function of the source's filters and the sender's id/username,
+    so repeat senders hit the memo cache instead of re-running the
+    membership checks.
+    """
+    key = (id(rule), sender_id, sender_username)
+    decision = _forward_decisions.get(key)
+    if decision is not None:
+        return decision
+
+    if not rule.filtered:
+        # No filtering configured, forward all messages
+        decision = True
+    else:
+        decision = (sender_id in rule.allow_user_ids
+                    or (sender_username is not None and sender_username in rule.allow_usernames))
+
+    # Simple size cap in the style of _name_cache; 4096 distinct
+    # (source, sender) pairs is far beyond what these chats see
+    if len(_forward_decisions) > 4096:
+        _forward_decisions.clear()
+    _forward_decisions[key] = decision
+    return decision
+
+def source_filters_by_username(rule):
+    """True when the source's allow-list includes usernames, which requires
+    the full sender entity to evaluate"""
+    return bool(rule.allow_usernames)
+
+# Cap the number of in-flight forwards so a burst of messages doesn't pile
+# unbounded concurrent uploads onto the connection
+forward_semaphore = asyncio.Semaphore(8)
+
+# Keep references to background forward tasks so they aren't garbage collected
+forward_tasks = set()
+
+async def _bounded_forward(event, chat, sender):
+    async with forward_semaphore:
+        await forward_message(event, chat=chat, sender=sender)
+
+def schedule_forward(event, chat=None, sender=None):
+    """Run forward_message as a background task so handlers don't block on sends
+
+    Entities the handler already resolved are passed along so
+    forward_message doesn't await them a second time.
+    """
+    task = asyncio.create_task(_bounded_forward(event, chat, sender))
+    forward_tasks.add(task)
+    task.add_done_callback(forward_tasks.discard)
+
+# Coalesce bursts of native forwards from the same chat into a single
+# forward_messages RPC; messages arriving within this window are batched
+NATIVE_BATCH_WINDOW = 0.25
+
+_native_batches = {}
+
+async def _flush_native_batch(target, chat_id):
+    await asyncio.sleep(NATIVE_BATCH_WINDOW)
+    messages = _native_batches.pop(chat_id)
+    try:
+        await call_with_flood_wait(client.forward_messages, target, messages)
+        logger.info("Forwarded %d message(s) natively from %s", len(messages), chat_id)
+    except Exception as e:
+        logger.error("Error forwarding batch from %s: %s", chat_id, e)
 
-async def forward_message(event):
+def enqueue_native_forward(target, message):
+    """Queue a message for native forwarding, batching per source chat
+
+    forward_messages accepts a list, so messages from the same chat that
+    arrive within NATIVE_BATCH_WINDOW go out in one RPC.
+    """
+    batch = _native_batches.get(message.chat_id)
+    if batch is not None:
+        batch.append(message)
+        return
+    _native_batches[message.chat_id] = [message]
+    task = asyncio.create_task(_flush_native_batch(target, message.chat_id))
+    forward_tasks.add(task)
+    task.add_done_callback(forward_tasks.discard)
+
+# Minimum spacing between outgoing sends; Telegram allows roughly 30
+# messages per second account-wide
+SEND_MIN_INTERVAL = 1 / 30
+
+_send_pace_lock = asyncio.Lock()
+_last_send_time = 0.0
+
+async def _pace_sends():
+    """Sleep just enough to keep outgoing sends under the global rate limit"""
+    global _last_send_time
+    async with _send_pace_lock:
+        now = asyncio.get_running_loop().time()
+        wait = _last_send_time + SEND_MIN_INTERVAL - now
+        if wait > 0:
+            await asyncio.sleep(wait)
+            now = asyncio.get_running_loop().time()
+        _last_send_time = now
+
+async def call_with_flood_wait(method, *args, **kwargs):
+    """Call a Telethon send method, waiting out a FloodWaitError once
+
+    Sleeping for the server-mandated delay instead of failing keeps the
+    forward semaphore held, which throttles the other in-flight forwards
+    while the account is rate limited.
+    """
+    try:
+        await _pace_sends()
+        return await method(*args, **kwargs)
+    except FloodWaitError as e:
+        logger.warning("Flood wait of %s seconds, sleeping before retrying", e.seconds)
+        await asyncio.sleep(e.seconds + 1)
+        await _pace_sends()
+        return await method(*args, **kwargs)
+
+# Bound concurrent media downloads so a burst of fallback downloads doesn't
+# monopolize the connection
+download_semaphore = asyncio.Semaphore(4)
+
+def display_name(entity):
+    """Best-effort display name for a user or chat entity"""
+    username = getattr(entity, 'username', None)
+    if username:
+        return f"@{username}"
+    return getattr(entity, 'first_name', None) or getattr(entity, 'title', None) or "Unknown"
+
+# Display names memoized by sender ID; active chats reply to the same small
+# set of users over and over, so this skips repeated entity fetches
+_name_cache = {}
+
+async def cached_sender_name(message):
+    """Display name for a message's sender, memoized by sender ID"""
+    sender_id = message.sender_id
+    if sender_id is not None:
+        name = _name_cache.get(sender_id)
+        if name is not None:
+            return name
+    name = display_name(await message.get_sender())
+    if sender_id is not None:
+        # Simple size cap instead of true LRU eviction; 1024 distinct
+        # senders is far beyond what these chats see in practice
+        if len(_name_cache) > 1024:
+            _name_cache.clear()
+        _name_cache[sender_id] = name
+    return name
+
+def has_forwardable_media(message):
+    """True when the message carries media that send_file can re-upload
+
+    Link previews (MessageMediaWebPage) are attached by Telegram rather
+    than uploaded, and Telethon cannot cast them to an input file; messages
+    carrying only a preview go out as plain text instead.
+    """
+    return message.media is not None and not isinstance(message.media, MessageMediaWebPage)
+
+async def download_to_buffer(message):
+    """Download a message's media into an in-memory buffer instead of disk
+
+    Returns None when there is nothing to download — download_media
+    returns None without writing a byte for unsupported media — so
+    callers can fall back to a text send instead of uploading an empty
+    file.
+    """
+    buffer = io.BytesIO()
+    async with download_semaphore:
+        result = await message.download_media(file=buffer)
+    if result is None or not buffer.getbuffer().nbytes:
+        return None
+    buffer.seek(0)
+    # Give the buffer a name so Telethon can infer the file type on upload
+    if message.file and message.file.name:
+        buffer.name = message.file.name
+    elif message.file and message.file.ext:
+        buffer.name = f"media{message.file.ext}"
+    return buffer
+
+async def forward_message(event, chat=None, sender=None):
     """Send a copy of the message to the target channel with source information"""
     try:
-        chat = await event.get_chat()
-        sender = await event.get_sender()
+        # Reuse entities the dispatching handler already resolved
+        if chat is None:
+            chat = event.chat or await event.get_chat()
+        if sender is None:
+            sender = event.sender or await event.get_sender()
+
+        # Use the target entity cached at startup so every send skips the
+        # ID -> entity resolution step
+        target = target_entity if target_entity is not None else config['target_channel_id']
+
+        # Kick the reply fetch off right away so the network round-trip
+        # overlaps with the rest of the per-message work
+        reply_task = None
+        if event.message.reply_to:
+            reply_task = asyncio.create_task(event.message.get_reply_message())
         message_text = event.message.text if event.message.text else ""
 
-        sender_name = None
-        if hasattr(sender, 'username') and sender.username:
-            sender_name = f"@{sender.username}"
-        elif hasattr(sender, 'first_name'):
-            sender_name = sender.first_name
-        elif hasattr(sender, 'title'):
-            sender_name = sender.title
-        else:
-            sender_name = "Unknown"
+        sender_name = display_name(sender)
 
-        logger.info(f"Attempting to send message from {chat.title} by {sender_name}")
-        logger.info(f"Message content: {message_text[:100]}{'...' if len(message_text) > 100 else ''}")
-
-        # Download media if present
-        media_path = None
-        if event.message.media:
-            logger.info(f"Message contains media, downloading...")
-            try:
-                os.makedirs("downloaded_media", exist_ok=True)
-                media_path = await event.message.download_media("downloaded_media")
-                logger.info(f"Media downloaded to: {media_path}")
-            except Exception as e:
-                logger.error(f"Error downloading media: {e}")
+        logger.info("Attempting to send message from %s by %s", chat.title, sender_name)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Message content: %s%s", message_text[:100], '...' if len(message_text) > 100 else '')
 
         # Find the source config for this message
-        source_config = None
         topic_id = None
+        source_config = (sources_by_channel_id.get(event.chat_id)
+                         or sources_by_private_group_id.get(event.chat_id)
+                         or sources_by_username.get(getattr(chat, 'username', None)))
 
-        for source in config['sources']:
-            if source['type'] == 'channel' and str(chat.id).replace('-100', '') == str(source['id']).replace('-100', ''):
-                source_config = source
-                break
-            elif source['type'] == 'private_group' and chat.id == source['id']:
-                source_config = source
-                break
-            elif source['type'] == 'public_group' and hasattr(chat, 'username') and chat.username == source['username']:
-                source_config = source
-                break
-
-        if source_config and 'target_topic' in source_config:
-            topic_id = source_config['target_topic']
-            logger.info(f"Using source-specific topic ID: {topic_id}")
+        if source_config and source_config.topic_id is not None:
+            topic_id = source_config.topic_id
+            logger.info("Using source-specific topic ID: %s", topic_id)
         elif 'topic_id' in config:
             topic_id = config['topic_id']
-            logger.info(f"Using global topic ID: {topic_id}")
+            logger.info("Using global topic ID: %s", topic_id)
         else:
             logger.info("No topic ID found, sending to main chat")
 
-        # If this message is a reply, send the replied-to message first and capture its message ID
+        # Native server-side forward: one RPC, no media transfer, but no
+        # From: header. Only used when the source opts in, the message is not
+        # part of a reply chain we rebuild, and no topic routing is needed
+        # (forward_messages cannot target a forum topic).
+        if (source_config and source_config.native_forward
+                and not event.message.reply_to and topic_id is None):
+            enqueue_native_forward(target, event.message)
+            return
+
+        # If this message is a reply, handle the replied-to message first.
+        # A reply with media still needs its own send so the main message
+        # can thread onto it; a text-only reply is folded into the main
+        # message body instead, saving a full round-trip.
         reply_to_msg_id = None
-        if event.message.reply_to:
+        reply_header = ""
+        if reply_task:
             try:
-                replied_message = await event.message.get_reply_message()
+                replied_message = await reply_task
                 if replied_message:
-                    replied_sender = await replied_message.get_sender()
-                    replied_sender_name = None
-                    if hasattr(replied_sender, 'username') and replied_sender.username:
-                        replied_sender_name = f"@{replied_sender.username}"
-                    elif hasattr(replied_sender, 'first_name'):
-                        replied_sender_name = replied_sender.first_name
-                    elif hasattr(replied_sender, 'title'):
-                        replied_sender_name = replied_sender.title
-                    else:
-                        replied_sender_name = "Unknown"
+                    replied_sender_name = await cached_sender_name(replied_message)
                     replied_text = replied_message.text if replied_message.text else ""
-                    replied_formatted = f"Replied from {replied_sender_name}:\n{replied_text}"
 
-                    # Download media if present in replied message
-                    replied_media_path = None
-                    if replied_message.media:
+                    if has_forwardable_media(replied_message):
+                        replied_formatted = (f"Replied from {replied_sender_name}:\n{replied_text}"
+                                             if replied_text else f"Replied from {replied_sender_name}")
                         try:
-                            os.makedirs("downloaded_media", exist_ok=True)
-                            replied_media_path = await replied_message.download_media("downloaded_media")
+                            sent = await call_with_flood_wait(
+                                client.send_file,
+                                target,
+                                replied_message.media,
+                                caption=replied_formatted,
+                                reply_to=topic_id
+                            )
                         except Exception as e:
-                            logger.error(f"Error downloading replied media: {e}")
-
-                    # Send the replied message first, with or without media
-                    if replied_media_path:
-                        sent = await client.send_file(
-                            config['target_channel_id'],
-                            replied_media_path,
-                            caption=replied_formatted if replied_text else f"Replied from {replied_sender_name}",
-                            reply_to=topic_id
-                        )
+                            logger.warning("Could not send replied media by reference, streaming a copy: %s", e)
+                            buffer = await download_to_buffer(replied_message)
+                            if buffer is None:
+                                # Nothing downloadable; deliver the reply as text
+                                sent = await call_with_flood_wait(
+                                    client.send_message,
+                                    target,
+                                    replied_formatted,
+                                    reply_to=topic_id
+                                )
+                            else:
+                                sent = await call_with_flood_wait(
+                                    client.send_file,
+                                    target,
+                                    buffer,
+                                    caption=replied_formatted,
+                                    reply_to=topic_id
+                                )
+                        reply_to_msg_id = sent.id
                     else:
-                        # If the replied message has no text and no media, send a placeholder
-                        if not replied_text:
-                            replied_formatted = f"Replied from {replied_sender_name}: [no text or media]"
-                        sent = await client.send_message(
-                            config['target_channel_id'],
-                            replied_formatted,
-                            reply_to=topic_id
-                        )
-                    reply_to_msg_id = sent.id
+                        reply_header = (f"Replied from {replied_sender_name}:\n"
+                                        f"{replied_text if replied_text else '[no text or media]'}\n\n")
             except Exception as e:
-                logger.error(f"Error forwarding replied message: {e}")
+                logger.error("Error forwarding replied message: %s", e)
 
-        # Prepare the formatted message for the main message
-        formatted_message = ""
-        if message_text:
-            formatted_message += f"{message_text}\n"
-        formatted_message += "--------------------------------\n"
-        formatted_message += f"From: {chat.title} - {sender_name}"
+        # Prepare the formatted message for the main message in one pass
+        footer_prefix = source_config.footer_prefix if source_config else None
+        if footer_prefix is None:
+            footer_prefix = f"--------------------------------\nFrom: {chat.title} - "
+        formatted_message = "".join(
+            (reply_header, f"{message_text}\n" if message_text else "", footer_prefix, sender_name)
+        )
 
         # Send the main message, replying to the forwarded replied message if applicable
         try:
-            if media_path:
-                logger.info(f"Sending message with downloaded media: {media_path}")
-                await client.send_file(
-                    config['target_channel_id'],
-                    media_path,
-                    caption=formatted_message,
-                    reply_to=reply_to_msg_id if reply_to_msg_id else topic_id
-                )
-                logger.info("Message sent with media successfully")
+            if has_forwardable_media(event.message):
+                # Pass the server-side media object so Telegram re-references the
+                # existing file instead of a download-then-reupload round-trip
+                try:
+                    await call_with_flood_wait(
+                        client.send_file,
+                        target,
+                        event.message.media,
+                        caption=formatted_message,
+                        reply_to=reply_to_msg_id if reply_to_msg_id else topic_id
+                    )
+                    logger.info("Message sent with media successfully")
+                except Exception as e:
+                    logger.warning("Could not send media by reference, streaming a copy: %s", e)
+                    buffer = await download_to_buffer(event.message)
+                    if buffer is None:
+                        # Nothing downloadable; deliver the text rather than
+                        # dropping the message
+                        await call_with_flood_wait(
+                            client.send_message,
+                            target,
+                            formatted_message,
+                            reply_to=reply_to_msg_id if reply_to_msg_id else topic_id
+                        )
+                        logger.info("Message sent as text successfully")
+                    else:
+                        await call_with_flood_wait(
+                            client.send_file,
+                            target,
+                            buffer,
+                            caption=formatted_message,
+                            reply_to=reply_to_msg_id if reply_to_msg_id else topic_id
+                        )
+                        logger.info("Message sent with streamed media successfully")
             else:
-                await client.send_message(
-                    config['target_channel_id'],
+                await call_with_flood_wait(
+                    client.send_message,
+                    target,
                     formatted_message,
                     reply_to=reply_to_msg_id if reply_to_msg_id else topic_id
                 )
                 logger.info("Message sent as text successfully")
         except Exception as e:
-            logger.error(f"Error sending message: {e}")
+            logger.error("Error sending message: %s", e)
     except Exception as e:
-        logger.error(f"Error in forward_message: {e}")
+        logger.error("Error in forward_message: %s", e)
 
 async def cleanup_downloaded_media():
-    """Clean up the downloaded_media directory"""
+    """Remove the downloaded_media directory left behind by older versions.
+
+    Media is now re-uploaded straight from memory, so nothing is ever
+    written here anymore; this just clears leftovers on upgrade. The
+    rmtree runs in a worker thread so a large directory can't stall the
+    event loop while handlers are already registered.
+    """
     try:
         if os.path.exists("downloaded_media"):
-            shutil.rmtree("downloaded_media")
-            os.makedirs("downloaded_media", exist_ok=True)
-            logger.info("Successfully cleaned up downloaded_media directory")
+            await asyncio.to_thread(shutil.rmtree, "downloaded_media")
+            logger.info("Removed leftover downloaded_media directory")
     except Exception as e:
-        logger.error(f"Error cleaning up downloaded_media directory: {e}")
-
-async def schedule_cleanup():
-    """Schedule daily cleanup at midnight"""
-    while True:
-        now = datetime.now()
-        # Calculate time until next midnight
-        next_midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
-        seconds_until_midnight = (next_midnight - now).total_seconds()
-        
-        # Wait until midnight
-        await asyncio.sleep(seconds_until_midnight)
-        
-        # Perform cleanup
-        await cleanup_downloaded_media()
+        logger.error("Error cleaning up downloaded_media directory: %s", e)
 
 async def main():
     """Main function to run the client"""
@@ -584,37 +923,41 @@ async def main():
         
         # Log successful connection
         me = await client.get_me()
-        logger.info(f"Connected as {me.first_name} (ID: {me.id})")
+        logger.info("Connected as %s (ID: %s)", me.first_name, me.id)
         
         # Resolve all entities at startup
         await resolve_entities(config)
         
+        # Build the source lookup tables (normalizing channel IDs) before
+        # any handler goes live so an early message can't miss the maps
+        build_source_maps(config)
+
         # Register event handlers
         await register_event_handlers()
-        
+
         # Print all configured sources for debugging
         if 'sources' in config and config.get('sources'):
             logger.info("Configured sources:")
             for source in config['sources']:
                 if source.get('type') == 'channel' and 'id' in source:
-                    logger.info(f"  - Channel: {source['id']}")
+                    logger.info("  - Channel: %s", source['id'])
                 elif source.get('type') == 'public_group' and 'username' in source:
-                    logger.info(f"  - Public group: {source['username']}")
+                    logger.info("  - Public group: %s", source['username'])
                 elif source.get('type') == 'private_group' and 'id' in source:
-                    logger.info(f"  - Private group: {source['id']}")
+                    logger.info("  - Private group: %s", source['id'])
                 else:
                     source_id = source.get('id', source.get('username', 'unknown'))
-                    logger.info(f"  - Unknown source type: {source.get('type', 'unknown')} ({source_id})")
+                    logger.info("  - Unknown source type: %s (%s)", source.get('type', 'unknown'), source_id)
         else:
             logger.warning("No sources configured. The bot is running but won't monitor any messages.")
         
-        # Start the cleanup scheduler
-        asyncio.create_task(schedule_cleanup())
-        
+        # Clear out any media left on disk by older versions
+        await cleanup_downloaded_media()
+
         # Keep the client running
         await client.run_until_disconnected()
     except Exception as e:
-        logger.error(f"Error in main function: {e}")
+        logger.error("Error in main function: %s", e)
         sys.exit(1)
     finally:
         # Make sure we disconnect cleanly
@@ -623,4 +966,11 @@ async def main():
             logger.info("Disconnected from Telegram")
 
 if __name__ == "__main__":
+    # Use uvloop when available for faster asyncio networking; fall back
+    # silently to the default event loop (e.g. on Windows)
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
     asyncio.run(main())
\ No newline at end of file